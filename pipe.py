@@ -1,10 +1,26 @@
 # wget https://raw.githubusercontent.com/erdongxin/pipe/refs/heads/main/pipe.py -O pipe.py && screen -dmS pipe bash -c 'python3 pipe.py'
 
 import os
+import time
+import random
 import logging
 import aiohttp
 import asyncio
-from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+# 优先使用orjson做JSON编解码（C扩展，节点多时明显更快），未安装则退回标准库
+try:
+    import orjson
+
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+
+    _json_dumps = json.dumps
+    _json_loads = json.loads
 
 # 基础配置
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,181 +28,234 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # 时间间隔配置
 HEARTBEAT_INTERVAL = 300  # 5分钟发送一次心跳
 TEST_INTERVAL = 600  # 10分钟进行一次节点测试
+TEST_CONCURRENCY = 50  # 节点测试的最大并发数，避免一次性打开过多套接字
 RETRY_DELAY = 5  # 重试延迟（秒）
+MAX_RETRY_DELAY = 30  # 指数退避的重试延迟上限（秒）
 MAX_RETRIES = 3  # 最大重试次数
 
 BASE_URL = "https://api.pipecdn.app/api"
 
+# 细分connect/sock_read的超时配置：连不上的主机快速失败，慢响应不被过早掐断
+FAST_TIMEOUT = aiohttp.ClientTimeout(total=5, connect=2, sock_read=3)
+REPORT_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=2, sock_read=5)
+
+# 心跳唤醒事件：置位后心跳循环立即醒来，不必等到下一个间隔
+heartbeat_wake = asyncio.Event()
+
+# 单个节点的测试结果，比逐条构造字典更轻量
+class NodeResult(NamedTuple):
+    node_id: Optional[str]
+    ip: Optional[str]
+    latency: float
+    status: str
+
+# pipe.txt解析结果缓存，按文件mtime判断是否需要重新读取
+_pipe_cache = {}
+
 # 本地读取pipe.txt中的Token信息
 def read_pipe_file():
-    """从服务器的pipe.txt中读取Token和邮箱信息"""
+    """从服务器的pipe.txt中读取Token和邮箱信息，文件未变化时返回缓存结果"""
     pipe_file_path = "/root/pipe.txt"
     if not os.path.exists(pipe_file_path):
-        logging.error(f"未找到 {pipe_file_path} 文件，无法读取Token和邮箱。")
+        logging.error("未找到 %s 文件，无法读取Token和邮箱。", pipe_file_path)
         return None
 
+    mtime = os.stat(pipe_file_path).st_mtime
+    if _pipe_cache.get('mtime') == mtime:
+        return _pipe_cache['info']
+
+    mapping = {}
     with open(pipe_file_path, 'r') as f:
-        lines = f.readlines()
-    
-    email = None
-    token = None
-    
-    for line in lines:
-        if line.startswith("email:"):
-            email = line.strip().split(":")[1].strip()
-        elif line.startswith("token:"):
-            token = line.strip().split(":")[1].strip()
-    
+        # partition只在第一个冒号处切分，token本身含":"也不会被截断
+        for line in f:
+            key, sep, value = line.partition(":")
+            if sep:
+                mapping[key.strip()] = value.strip()
+
+    email = mapping.get("email")
+    token = mapping.get("token")
+
     if not email or not token:
         logging.error("未从pipe.txt中获取到有效的邮箱和Token信息。")
         return None
-    
-    return {"email": email, "token": token}
+
+    info = {"email": email, "token": token}
+    _pipe_cache['mtime'] = mtime
+    _pipe_cache['info'] = info
+    return info
+
+# 公网IP缓存：IP很少变化，缓存一小时内的查询结果，避免每次心跳都请求ipify
+IP_CACHE_TTL = 3600
+_ip_cache = {"ip": None, "ts": 0}
 
 # 获取当前IP地址
-async def get_ip():
-    """获取当前IP地址"""
-    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-        try:
-            async with session.get("https://api64.ipify.org?format=json", timeout=5) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data.get('ip')
-        except Exception as e:
-            logging.error(f"获取IP失败: {e}")
-            await asyncio.sleep(RETRY_DELAY)
+async def get_ip(session):
+    """获取当前IP地址，缓存未过期时直接返回缓存值"""
+    if _ip_cache["ip"] and time.time() - _ip_cache["ts"] < IP_CACHE_TTL:
+        return _ip_cache["ip"]
+
+    try:
+        async with session.get("https://api64.ipify.org?format=json", timeout=FAST_TIMEOUT) as response:
+            if response.status == 200:
+                data = await response.json(loads=_json_loads)
+                ip = data.get('ip')
+                if ip:
+                    _ip_cache["ip"] = ip
+                    _ip_cache["ts"] = time.time()
+                return ip
+    except Exception as e:
+        logging.error("获取IP失败: %s", e)
+        await asyncio.sleep(RETRY_DELAY)
     return None
 
 # 发送心跳信号
-async def send_heartbeat(token):
+async def send_heartbeat(session, token, headers):
     """发送心跳信号"""
-    ip = await get_ip()
-    if not ip:
-        logging.error(f"无法获取IP，无法发送心跳，Token: {token}")
-        return False
-
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
-    data = {"ip": ip}
-    
     retries = 0
     while retries < MAX_RETRIES:
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            try:
-                async with session.post(f"{BASE_URL}/heartbeat", headers=headers, json=data, timeout=5) as response:
-                    if response.status == 201:  # 修改为201，表示心跳发送成功
-                        logging.info(f"成功发送心跳，Token: {token}")
-                        return True
-                    elif response.status == 429:
-                        logging.warning(f"请求过于频繁，Token: {token}")
-                        return False
-                    else:
-                        logging.warning(f"心跳发送失败，状态码: {response.status}, Token: {token}")
-            except Exception as e:
-                logging.error(f"发送心跳失败: {e}")
-        
+        # 每次尝试都重新取IP：缓存有效时只是字典查询，缓存被作废后重试能带上新地址
+        ip = await get_ip(session)
+        if not ip:
+            logging.error("无法获取IP，无法发送心跳，Token: %s", token)
+            return False
+
+        data = {"ip": ip}
+        try:
+            async with session.post(f"{BASE_URL}/heartbeat", headers=headers, json=data, timeout=FAST_TIMEOUT) as response:
+                if response.status == 201:  # 修改为201，表示心跳发送成功
+                    logging.info("成功发送心跳，Token: %s", token)
+                    return True
+                elif response.status == 429:
+                    logging.warning("请求过于频繁，Token: %s", token)
+                    return False
+                else:
+                    logging.warning("心跳发送失败，状态码: %s, Token: %s", response.status, token)
+                    # 心跳被拒可能是IP已变化，作废缓存并唤醒心跳循环立即重试
+                    _ip_cache["ip"] = None
+                    heartbeat_wake.set()
+        except Exception as e:
+            logging.error("发送心跳失败: %s", e)
+
+        # 指数退避加随机抖动，既能快速恢复又避免重试打到同一时刻
+        delay = min(RETRY_DELAY * (2 ** retries) + random.uniform(0, 0.5), MAX_RETRY_DELAY)
         retries += 1
-        logging.info(f"心跳发送失败，正在重试 {retries}/{MAX_RETRIES}...")
-        await asyncio.sleep(RETRY_DELAY)
+        logging.info("心跳发送失败，正在重试 %s/%s...", retries, MAX_RETRIES)
+        await asyncio.sleep(delay)
 
-    logging.error(f"心跳发送失败，达到最大重试次数: {MAX_RETRIES}")
+    logging.error("心跳发送失败，达到最大重试次数: %s", MAX_RETRIES)
     return False
 
-async def start_testing(token):
+async def start_testing(session, headers):
     """执行节点测试并报告结果"""
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
-    
-    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-        try:
-            async with session.get(f"{BASE_URL}/nodes", headers=headers, timeout=5) as response:
-                if response.status == 200:
-                    nodes = await response.json()
-
-                    # 打印节点数据，查看实际数据格式
-                    logging.info(f"获取的节点数据: {nodes}")
-                    
-                    # 检查数据格式是否为字典列表
-                    if isinstance(nodes, list) and all(isinstance(node, dict) for node in nodes):
-                        results = await test_all_nodes(nodes)  # 批量测试函数
-                        await report_all_node_results(token, results)  # 报告结果的函数
-                    else:
-                        logging.error("获取到的节点数据格式不正确。应该是列表且每个元素是字典。")
+    try:
+        async with session.get(f"{BASE_URL}/nodes", headers=headers, timeout=FAST_TIMEOUT) as response:
+            if response.status == 200:
+                nodes = await response.json(loads=_json_loads)
+
+                # 打印节点数据，查看实际数据格式
+                logging.info("获取的节点数据: %s", nodes)
+
+                # 检查数据格式是否为字典列表
+                if isinstance(nodes, list) and all(isinstance(node, dict) for node in nodes):
+                    results = await test_all_nodes(session, nodes)  # 批量测试函数
+                    await report_all_node_results(session, headers, results)  # 报告结果的函数
                 else:
-                    logging.warning(f"获取节点失败，状态码: {response.status}")
-        except Exception as e:
-            logging.error(f"获取节点失败: {e}")
+                    logging.error("获取到的节点数据格式不正确。应该是列表且每个元素是字典。")
+            else:
+                logging.warning("获取节点失败，状态码: %s", response.status)
+    except Exception as e:
+        logging.error("获取节点失败: %s", e)
+
+async def test_all_nodes(session, nodes):
+    """并发测试所有节点，并发数由信号量限制"""
+    # 限制同时在测的节点数，保持在途连接数接近连接池大小
+    sem = asyncio.Semaphore(TEST_CONCURRENCY)
 
-async def test_all_nodes(nodes):
-    """同时测试所有节点"""
     async def test_single_node(node):
-        try:
-            start = asyncio.get_event_loop().time()
-            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
+        async with sem:
+            try:
+                start = asyncio.get_event_loop().time()
                 # 确保node是字典并且包含node_id和ip
                 if isinstance(node, dict) and 'node_id' in node and 'ip' in node:
                     node_id, ip = node['node_id'], node['ip']
-                    async with session.get(f"http://{ip}", timeout=5) as node_response:
-                        latency = (asyncio.get_event_loop().time() - start) * 1000
-                        status = "在线" if node_response.status == 200 else "离线"
-                        latency_value = latency if status == "在线" else -1
-                        return {"node_id": node_id, "ip": ip, "latency": latency_value, "status": status}
+                    # HEAD只传输响应头，不下载页面内容
+                    async with session.head(f"http://{ip}", timeout=FAST_TIMEOUT, allow_redirects=False) as node_response:
+                        probe_status = node_response.status
+                    if probe_status == 405:
+                        # 节点不支持HEAD时退回只取1字节的Range GET；
+                        # 重置计时起点，上报的延迟只统计一次往返
+                        start = asyncio.get_event_loop().time()
+                        range_headers = {"Range": "bytes=0-0"}
+                        async with session.get(f"http://{ip}", headers=range_headers, timeout=FAST_TIMEOUT, allow_redirects=False) as node_response:
+                            probe_status = node_response.status
+                    latency = (asyncio.get_event_loop().time() - start) * 1000
+                    status = "在线" if probe_status in (200, 206) else "离线"
+                    latency_value = latency if status == "在线" else -1
+                    return NodeResult(node_id, ip, latency_value, status)
                 else:
-                    logging.error(f"节点数据格式错误: {node}")
-                    return {"node_id": None, "ip": None, "latency": -1, "status": "数据格式错误"}
-        except (asyncio.TimeoutError, aiohttp.ClientConnectorError) as e:
-            logging.error(f"测试节点失败: {e}")
-            return {"node_id": node.get('node_id', '未知'), "ip": node.get('ip', '未知'), "latency": -1, "status": "离线"}
+                    logging.error("节点数据格式错误: %s", node)
+                    return NodeResult(None, None, -1, "数据格式错误")
+            except (asyncio.TimeoutError, aiohttp.ClientConnectorError) as e:
+                logging.error("测试节点失败: %s", e)
+                return NodeResult(node.get('node_id', '未知'), node.get('ip', '未知'), -1, "离线")
 
     # 创建测试任务并执行
     tasks = [test_single_node(node) for node in nodes]
     return await asyncio.gather(*tasks)
 
 # 报告所有节点测试结果
-async def report_all_node_results(token, results):
-    """报告所有节点的测试结果"""
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
-    
-    for result in results:
-        test_data = {
-            "node_id": result['node_id'],
-            "ip": result['ip'],
-            "latency": result['latency'],
-            "status": result['status']
-        }
-        
-        # 打印请求信息
-        logging.info(f"准备提交请求，URL: {BASE_URL}/test")
-        logging.info(f"请求头: {headers}")
-        logging.info(f"请求体: {test_data}")
-        
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            try:
-                logging.info(f"正在提交节点测试结果: {test_data}")
-                # 增加更长的超时时间（例如 10秒）
-                async with session.post(f"{BASE_URL}/test", headers=headers, json=test_data, timeout=10) as response:
-                    status_code = response.status
-                    response_text = await response.text()
-                    
-                    # 打印响应信息
-                    logging.info(f"收到响应，状态码: {status_code}, 响应内容: {response_text}")
-                
-                    if status_code == 200:
-                        logging.info(f"节点测试结果已提交成功，Node ID: {result['node_id']}, IP: {result['ip']}")
-                    else:
-                        logging.error(f"节点测试结果提交失败，状态码: {status_code}, 返回内容: {response_text}")
-            except asyncio.TimeoutError as e:
-                logging.error(f"提交节点测试结果失败: 请求超时 - {e}")
-            except Exception as e:
-                logging.exception(f"提交节点测试结果失败: {e}")
+async def report_all_node_results(session, headers, results):
+    """并发报告所有节点的测试结果"""
+    async def report_single_result(result):
+        test_data = result._asdict()
+
+        try:
+            logging.info("正在提交节点测试结果: %s", test_data)
+            # 增加更长的超时时间（例如 10秒）
+            async with session.post(f"{BASE_URL}/test", headers=headers, json=test_data, timeout=REPORT_TIMEOUT) as response:
+                status_code = response.status
+                response_text = await response.text()
+
+                # 打印响应信息
+                logging.info("收到响应，状态码: %s, 响应内容: %s", status_code, response_text)
+
+                if status_code == 200:
+                    logging.info("节点测试结果已提交成功，Node ID: %s, IP: %s", result.node_id, result.ip)
+                else:
+                    logging.error("节点测试结果提交失败，状态码: %s, 返回内容: %s", status_code, response_text)
+        except asyncio.TimeoutError as e:
+            logging.error("提交节点测试结果失败: 请求超时 - %s", e)
+        except Exception as e:
+            logging.exception("提交节点测试结果失败: %s", e)
+
+    # 并发提交全部结果，总耗时取决于最慢的一次请求而不是结果数量
+    tasks = [report_single_result(result) for result in results]
+    await asyncio.gather(*tasks)
+
 
+# 心跳循环
+async def heartbeat_loop(session, token, headers):
+    """按心跳间隔循环发送心跳，失败时缩短等待后重试"""
+    logging.info("开始首次心跳...")
+    while True:
+        heartbeat_sent = await send_heartbeat(session, token, headers)
+        timeout = HEARTBEAT_INTERVAL if heartbeat_sent else RETRY_DELAY
+        if heartbeat_sent:
+            # 成功后丢弃过期的唤醒信号，避免紧接着重复发送
+            heartbeat_wake.clear()
+        # 等待唤醒事件或超时，事件置位时立即发送下一次心跳
+        try:
+            await asyncio.wait_for(heartbeat_wake.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        heartbeat_wake.clear()
+
+# 节点测试循环
+async def test_loop(session, headers):
+    """按测试间隔循环执行节点测试"""
+    while True:
+        await start_testing(session, headers)
+        await asyncio.sleep(TEST_INTERVAL)
 
 # 运行节点命令
 async def run_node():
@@ -195,44 +264,40 @@ async def run_node():
     if not server_info:
         logging.error("无法加载Token和邮箱信息，退出运行。")
         return
-    
+
     token = server_info["token"]
     email = server_info["email"]
 
-    logging.info(f"邮箱: {email}，Token: {token} 已加载，开始运行节点。")
-
-    # 心跳定时任务
-    next_heartbeat_time = datetime.now()
-    next_test_time = datetime.now()
-    first_heartbeat = True
+    logging.info("邮箱: %s，Token: %s 已加载，开始运行节点。", email, token)
 
-    last_log_time = datetime.now()  # 用于控制日志输出的时间
-
-    try:
-        while True:
-            current_time = datetime.now()
-
-            # 每次心跳间隔发送心跳
-            if current_time >= next_heartbeat_time:
-                if first_heartbeat:
-                    logging.info("开始首次心跳...")
-                    first_heartbeat = False
-
-                # 发送心跳请求并检查发送是否成功
-                heartbeat_sent = await send_heartbeat(token)
-                if heartbeat_sent:
-                    next_heartbeat_time = current_time + timedelta(seconds=HEARTBEAT_INTERVAL)
-                else:
-                    next_heartbeat_time = current_time + timedelta(seconds=RETRY_DELAY)
-
-            # 每次测试间隔执行节点测试
-            if current_time >= next_test_time:
-                await start_testing(token)
-                next_test_time = current_time + timedelta(seconds=TEST_INTERVAL)
+    # 认证头只构造一次，后续请求直接复用；aiohttp不会修改传入的字典
+    auth_headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+    }
 
-            await asyncio.sleep(1)
-    except KeyboardInterrupt:
-        logging.info("\n停止节点，返回主菜单...")
+    # 所有请求复用同一个会话，避免每次请求都重新建立TCP/TLS连接；
+    # 连接池带DNS缓存与keepalive，跨心跳和测试周期复用连接
+    connector = aiohttp.TCPConnector(
+        ssl=False,
+        limit=100,
+        limit_per_host=20,
+        ttl_dns_cache=300,
+        keepalive_timeout=75,
+        enable_cleanup_closed=True,
+    )
+    async with aiohttp.ClientSession(connector=connector, json_serialize=_json_dumps) as session:
+        # 心跳与测试作为独立任务并行运行，测试周期耗时不会推迟心跳
+        heartbeat_task = asyncio.create_task(heartbeat_loop(session, token, auth_headers))
+        testing_task = asyncio.create_task(test_loop(session, auth_headers))
+        try:
+            await asyncio.gather(heartbeat_task, testing_task)
+        except KeyboardInterrupt:
+            logging.info("\n停止节点，返回主菜单...")
+        finally:
+            # 任一任务异常退出时取消另一个，避免遗留任务拖住会话关闭
+            heartbeat_task.cancel()
+            testing_task.cancel()
 
 # 执行主逻辑
 if __name__ == "__main__":